@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Benchmark bind archive creation: the previous tarfile 'w:gz' (level 9) path
+against connect.create_tar_gz_archive with the compression planner, reporting
+archive size, build time and the estimated build + base64 transfer time at a
+few link rates.
+
+Usage: ./bench_archive.py [folder] [--bw 250000,2097152,20000000] [--repeat R]
+The folder is copied to a temporary directory first, since archiving writes
+checksum.txt into it.
+"""
+import argparse
+import io
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+
+import connect
+
+def build_previous(source_dir, arcname):
+    """The create_tar_gz_archive path before the planner: checksums, then tarfile w:gz."""
+    checksum_file_path = os.path.join(source_dir, "checksum.txt")
+    checksum_lines = connect.compute_checksums(source_dir, checksum_file_path)
+    with open(checksum_file_path, 'w') as f:
+        for line in checksum_lines:
+            f.write(line + "\n")
+    bio = io.BytesIO()
+    with tarfile.open(fileobj=bio, mode='w:gz') as tar:
+        tar.add(source_dir, arcname=arcname)
+    return bio.getvalue()
+
+def timed(repeat, func, *args):
+    """Return (result, best elapsed seconds) over repeat runs."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+def main():
+    default_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bind", "docker-ssc338q")
+    parser = argparse.ArgumentParser(description="Bind archive size/build-time benchmark")
+    parser.add_argument("folder", nargs="?", default=default_folder, help="Bind folder to archive")
+    parser.add_argument("--bw", default="250000,2097152,20000000",
+                        help="Comma separated link rates in bits/sec (default: 250000,2097152,20000000)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case, best time is reported (default: 3)")
+    parser.add_argument("--debug", action="store_true", help="Show the planner's per-level estimates")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO, format='%(message)s')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        arcname = os.path.basename(os.path.normpath(args.folder))
+        source_dir = os.path.join(tmp, arcname)
+        shutil.copytree(args.folder, source_dir)
+        # Write checksum.txt once so every case archives the same files.
+        connect.create_tar_gz_archive(source_dir, arcname, level=0)
+
+        print(f"{'link bit/s':>11}  {'method':<18}{'level':>6}{'bytes':>10}{'build ms':>10}{'total s':>9}")
+        previous, previous_time = timed(args.repeat, build_previous, source_dir, arcname)
+        for bw in (int(value) for value in args.bw.split(",")):
+            bytes_per_sec = bw / 8.0
+            total = previous_time + len(previous) * connect.BASE64_OVERHEAD / bytes_per_sec
+            print(f"{bw:>11}  {'previous w:gz':<18}{9:>6}{len(previous):>10}{previous_time * 1000:>10.1f}{total:>9.2f}")
+            level, _, _ = connect.choose_gzip_level(*connect.build_tar(source_dir, arcname), bw)
+            planned, planned_time = timed(args.repeat, connect.create_tar_gz_archive, source_dir, arcname, bw)
+            total = planned_time + len(planned) * connect.BASE64_OVERHEAD / bytes_per_sec
+            print(f"{bw:>11}  {'planner':<18}{level:>6}{len(planned):>10}{planned_time * 1000:>10.1f}{total:>9.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for line framing: the previous makefile()/readline()/decode()
+path against line_proto.LineReader, for small stats-sized lines and for a
+multi-MB BIND-sized line, plus the send path (f-string + encode against
+line_proto.send_line).
+
+Usage: ./bench_line_proto.py [--small N] [--big-mb M] [--repeat R]
+"""
+import argparse
+import base64
+import os
+import socket
+import threading
+import time
+
+import line_proto
+
+def feed(sock, payload):
+    """Write payload to sock from a thread, then close the write side."""
+    def writer():
+        sock.sendall(payload)
+        sock.shutdown(socket.SHUT_WR)
+    thread = threading.Thread(target=writer)
+    thread.start()
+    return thread
+
+def recv_legacy(payload):
+    a, b = socket.socketpair()
+    thread = feed(a, payload)
+    start = time.perf_counter()
+    stream = b.makefile('rb')
+    lines = 0
+    while True:
+        line = stream.readline()
+        if not line:
+            break
+        line.decode("utf-8").strip().split("\t")
+        lines += 1
+    elapsed = time.perf_counter() - start
+    thread.join()
+    a.close()
+    b.close()
+    return lines, elapsed
+
+def recv_line_proto(payload):
+    a, b = socket.socketpair()
+    thread = feed(a, payload)
+    start = time.perf_counter()
+    lines = 0
+    for line in line_proto.LineReader(b.recv_into):
+        line_proto.split_fields(line.strip())
+        lines += 1
+    elapsed = time.perf_counter() - start
+    thread.join()
+    a.close()
+    b.close()
+    return lines, elapsed
+
+def drain(sock):
+    def reader():
+        buf = bytearray(1 << 20)
+        while sock.recv_into(buf):
+            pass
+    thread = threading.Thread(target=reader)
+    thread.start()
+    return thread
+
+def send_legacy(encoded, count):
+    a, b = socket.socketpair()
+    thread = drain(b)
+    stream = a.makefile('wb')
+    start = time.perf_counter()
+    text = encoded.decode("utf-8")
+    for _ in range(count):
+        stream.write(f"BIND\t{text}\n".encode("utf-8"))
+        stream.flush()
+    elapsed = time.perf_counter() - start
+    stream.close()
+    a.close()
+    thread.join()
+    b.close()
+    return elapsed
+
+def send_line_proto(encoded, count):
+    a, b = socket.socketpair()
+    thread = drain(b)
+    start = time.perf_counter()
+    for _ in range(count):
+        line_proto.send_line(a, b"BIND", encoded)
+    elapsed = time.perf_counter() - start
+    a.close()
+    thread.join()
+    b.close()
+    return elapsed
+
+def best_of(repeat, func, *args):
+    results = [func(*args) for _ in range(repeat)]
+    return min(results, key=lambda r: r[1] if isinstance(r, tuple) else r)
+
+def report(name, nbytes, lines, elapsed):
+    print(f"{name:<28}{lines:>9}{elapsed * 1000:>11.1f}{nbytes / elapsed / 1e6:>10.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Line framing throughput benchmark")
+    parser.add_argument("--small", type=int, default=100000, help="Number of small lines (default: 100000)")
+    parser.add_argument("--big-mb", type=int, default=8, help="Size of the large line payload in MB (default: 8)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case, best is reported (default: 3)")
+    args = parser.parse_args()
+
+    small_line = b"ACK:BITRATE\t12345\tBitrate updated to 12000 (increased)" + b" " * 200 + b"\n"
+    small = small_line * args.small
+    encoded = base64.b64encode(os.urandom(args.big_mb * 1024 * 1024 * 3 // 4))
+    big = b"OK\t" + encoded + b"\n"
+
+    print(f"{'case':<28}{'lines':>9}{'ms':>11}{'MB/s':>10}")
+    for label, payload in (("small", small), ("big", big)):
+        lines, elapsed = best_of(args.repeat, recv_legacy, payload)
+        report(f"recv {label} makefile", len(payload), lines, elapsed)
+        lines, elapsed = best_of(args.repeat, recv_line_proto, payload)
+        report(f"recv {label} line_proto", len(payload), lines, elapsed)
+    count = 4
+    elapsed = best_of(args.repeat, send_legacy, encoded, count)
+    report("send big makefile", len(big) * count, count, elapsed)
+    elapsed = best_of(args.repeat, send_line_proto, encoded, count)
+    report("send big line_proto", len(big) * count, count, elapsed)
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,10 @@ import base64
 import hashlib
 import tarfile
 import io
+import struct
+import zlib
+
+import line_proto
 
 # Try to import yaml for parsing INFO output; if unavailable, use fallback.
 try:
@@ -16,6 +20,19 @@ try:
 except ImportError:
     yaml = None
 
+DEFAULT_BW_LIMIT = 2 * 1024 * 1024  # bits/sec
+
+# Compression planner parameters for bind archives.
+GZIP_LEVELS = (0, 1, 3, 6, 9)     # Candidate levels, 0 stores without deflate
+SAMPLE_FRACTION = 8               # Sample 1/8 of the archive (per level) to estimate size and time
+SAMPLE_MIN_SIZE = 32 * 1024       # ... but at least this much, if available
+SAMPLE_MAX_SIZE = 256 * 1024      # ... and at most this much
+SAMPLE_CHUNKS = 2                 # Evenly spaced chunks a sample is taken from
+STORE_MIN_SIZE = 4096             # Smaller members are always deflated with the rest
+STORED_BLOCK_SIZE = 0xFFFF        # Max payload of a stored deflate block (5 byte header)
+FULL_FLUSH_COST = 64              # Bytes charged per stored run: flush, empty block, lost history
+BASE64_OVERHEAD = 4.0 / 3.0       # BIND payloads are base64 encoded on the wire
+
 # -------------------- Utility Functions --------------------
 
 def compute_sha1(file_path):
@@ -43,13 +60,187 @@ def compute_checksums(directory, checksum_file_path):
             checksum_lines.append(f"{sha1_hash}  {rel_path}")
     return checksum_lines
 
-def create_tar_gz_archive(source_dir, arcname):
+def build_tar(source_dir, arcname):
+    """
+    Build an uncompressed tar of source_dir in memory (same member order as tarfile.add).
+    Returns (tar bytes, list of (start, end) byte ranges holding the data of
+    members of at least STORE_MIN_SIZE bytes, the candidates for storing).
+    """
+    bio = io.BytesIO()
+    member_ranges = []
+    with tarfile.open(fileobj=bio, mode='w') as tar:
+        def add(path, name):
+            tarinfo = tar.gettarinfo(path, name)
+            if tarinfo.isreg():
+                with open(path, 'rb') as f:
+                    data = f.read()
+                tar.addfile(tarinfo, io.BytesIO(data))
+                # Member data sits just before its padding to the next 512 byte block.
+                padded = -(-tarinfo.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+                start = tar.offset - padded
+                if tarinfo.size >= STORE_MIN_SIZE:
+                    member_ranges.append((start, start + tarinfo.size))
+            else:
+                tar.addfile(tarinfo)
+            if tarinfo.isdir():
+                for entry in sorted(os.listdir(path)):
+                    add(os.path.join(path, entry), os.path.join(name, entry))
+        add(source_dir, arcname)
+    return bio.getvalue(), member_ranges
+
+def split_segments(data, stored_ranges):
+    """Split data into (memoryview, compress) segments along the stored ranges."""
+    view = memoryview(data)
+    segments = []
+    pos = 0
+    for start, end in stored_ranges:
+        if start > pos:
+            segments.append((view[pos:start], True))
+        segments.append((view[start:end], False))
+        pos = end
+    if pos < len(data):
+        segments.append((view[pos:], True))
+    return segments
+
+def spread_sample(views, size):
+    """
+    Return up to size bytes of the concatenated views, taken from SAMPLE_CHUNKS
+    evenly spaced chunks so the sample is not just the start of the data.
+    """
+    total = sum(len(view) for view in views)
+    if total <= size:
+        return b"".join(views)
+    part = size // SAMPLE_CHUNKS
+    step = total // SAMPLE_CHUNKS
+    sample = bytearray()
+    idx = 0
+    base = 0  # Offset of views[idx] in the concatenation
+    for i in range(SAMPLE_CHUNKS):
+        offset = i * step
+        while base + len(views[idx]) <= offset:
+            base += len(views[idx])
+            idx += 1
+        pos = offset - base
+        need = part
+        j = idx
+        while need and j < len(views):
+            piece = views[j][pos:pos + need]
+            sample += piece
+            need -= len(piece)
+            pos = 0
+            j += 1
+    return bytes(sample)
+
+def sample_deflate(sample, length, level):
+    """Deflate a sample of length bytes of data; return (estimated size, estimated seconds)."""
+    if not sample:
+        return 0, 0.0
+    start = time.perf_counter()
+    out_len = len(zlib.compress(sample, level))
+    elapsed = time.perf_counter() - start
+    scale = length / len(sample)
+    return out_len * scale, elapsed * scale
+
+def stored_size(length):
+    """Size of length bytes written as stored deflate blocks."""
+    return length + 5 * -(-length // STORED_BLOCK_SIZE)
+
+def choose_gzip_level(data, member_ranges, bw_limit, levels=GZIP_LEVELS):
+    """
+    Plan the archive: pick the gzip level and the members to store without
+    deflate so that build time plus base64 transfer time at bw_limit is minimal.
+
+    Each member range and the rest of the tar are sampled (SAMPLE_FRACTION of
+    their size, spread over the data) and deflated at every candidate level;
+    the measured size and time are extrapolated. At each level a member is
+    stored when sending it as stored blocks (plus FULL_FLUSH_COST) costs less
+    than deflating and sending it, so an already compressed member is still
+    deflated when that saves more transfer time than it costs CPU time.
+    Returns (level, stored ranges, {level: (estimated size, estimated seconds)}).
+    """
+    view = memoryview(data)
+    bytes_per_sec = bw_limit / 8.0
+    send_time = BASE64_OVERHEAD / bytes_per_sec  # Seconds per archive byte
+
+    def sample_size(length):
+        return min(length, max(SAMPLE_MIN_SIZE, min(SAMPLE_MAX_SIZE, length // SAMPLE_FRACTION)))
+
+    rest = []
+    pos = 0
+    for start, end in member_ranges:
+        rest.append(view[pos:start])
+        pos = end
+    rest.append(view[pos:])
+    rest_len = sum(len(part) for part in rest)
+    rest_sample = spread_sample(rest, sample_size(rest_len))
+    members = [(start, end, spread_sample([view[start:end]], sample_size(end - start)))
+               for start, end in member_ranges]
+
+    estimates = {}
+    plans = {}
+    for level in levels:
+        if level == 0:
+            # Level 0 writes everything as stored blocks; nothing to decide.
+            size = stored_size(len(data))
+            estimates[level] = (size, size * send_time)
+            plans[level] = []
+            continue
+        size, seconds = sample_deflate(rest_sample, rest_len, level)
+        stored = []
+        for start, end, sample in members:
+            deflated, deflate_time = sample_deflate(sample, end - start, level)
+            store = stored_size(end - start) + FULL_FLUSH_COST
+            if store * send_time < deflate_time + deflated * send_time:
+                stored.append((start, end))
+                size += store
+            else:
+                size += deflated
+                seconds += deflate_time
+        estimates[level] = (int(size), seconds + size * send_time)
+        plans[level] = stored
+    level = min(levels, key=lambda lvl: estimates[lvl][1])
+    return level, plans[level], estimates
+
+def gzip_segments(segments, level):
+    """
+    Write segments as a single gzip member: compressible segments are deflated
+    at the given level, the others are emitted as stored deflate blocks. The
+    compressor is fully flushed (byte aligned, history reset) before each
+    stored run, so any gunzip, including busybox on the drone, can extract it.
+    """
+    out = bytearray(b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\x03')
+    comp = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    crc = 0
+    size = 0
+    pending = False
+    for seg, compress in segments:
+        crc = zlib.crc32(seg, crc)
+        size += len(seg)
+        if compress:
+            out += comp.compress(seg)
+            pending = True
+            continue
+        if pending:
+            out += comp.flush(zlib.Z_FULL_FLUSH)
+            pending = False
+        for offset in range(0, len(seg), STORED_BLOCK_SIZE):
+            block = seg[offset:offset + STORED_BLOCK_SIZE]
+            # Non-final stored block header: BFINAL=0, BTYPE=00, then LEN/NLEN.
+            out += struct.pack('<BHH', 0, len(block), len(block) ^ 0xFFFF)
+            out += block
+    out += comp.flush(zlib.Z_FINISH)
+    out += struct.pack('<II', crc & 0xFFFFFFFF, size & 0xFFFFFFFF)
+    return bytes(out)
+
+def create_tar_gz_archive(source_dir, arcname, bw_limit=DEFAULT_BW_LIMIT, level=None):
     """
     Create a tar.gz archive of the source directory.
     Before archiving, compute the SHA1 checksums of all files (excluding checksum.txt)
     and write them into checksum.txt in the root of the folder.
+    Members that do not pay for their deflate time at bw_limit are stored
+    without deflate and, unless a level is given, the gzip level is chosen for
+    the link rate as well (see choose_gzip_level).
     """
-    bio = io.BytesIO()
     checksum_file_path = os.path.join(source_dir, "checksum.txt")
     # Compute checksums excluding checksum.txt itself.
     checksum_lines = compute_checksums(source_dir, checksum_file_path)
@@ -60,43 +251,53 @@ def create_tar_gz_archive(source_dir, arcname):
             f.write(line + "\n")
     
     # Create tar.gz archive including checksum.txt and all other files
-    with tarfile.open(fileobj=bio, mode='w:gz') as tar:
-        tar.add(source_dir, arcname=arcname)
-    
-    bio.seek(0)
-    return bio.read()
+    tar_data, member_ranges = build_tar(source_dir, arcname)
+    levels = GZIP_LEVELS if level is None else (level,)
+    level, stored_ranges, estimates = choose_gzip_level(tar_data, member_ranges, bw_limit, levels)
+    for lvl, (size, seconds) in sorted(estimates.items()):
+        logging.debug(f"gzip level {lvl}: ~{size} bytes, ~{seconds:.2f}s to build and send")
+    logging.debug(f"Archive plan: gzip level {level}, {len(stored_ranges)} member(s) stored "
+                  f"({sum(end - start for start, end in stored_ranges)} of {len(tar_data)} bytes)")
+    return gzip_segments(split_segments(tar_data, stored_ranges), level)
 
-def send_rate_limited(sock_file, data, bw_limit, progress=False):
-    """Send data using bandwidth limiting."""
+def send_rate_limited(sock, buffers, bw_limit, progress=False):
+    """
+    Send a sequence of buffers (e.g. from line_proto.line_buffers) using bandwidth limiting.
+    Chunks are memoryview slices, so the payload is never copied.
+    """
     bw_bytes_per_sec = bw_limit / 8.0
     chunk_size = 4096
-    total = len(data)
+    total = sum(len(buf) for buf in buffers)
     sent = 0
     start_time = time.time()
     
-    while sent < total:
-        end = min(sent + chunk_size, total)
-        chunk = data[sent:end]
-        sock_file.write(chunk)
-        sock_file.flush()
-        sent += len(chunk)
-        elapsed = time.time() - start_time
-        expected = sent / bw_bytes_per_sec
-        if expected > elapsed:
-            time.sleep(expected - elapsed)
-        if progress:
-            percent = sent / total * 100
-            bar_length = 40
-            filled_length = int(round(bar_length * sent / total))
-            bar = '=' * filled_length + '-' * (bar_length - filled_length)
-            sys.stdout.write(f'\rProgress: [{bar}] {percent:6.2f}%')
-            sys.stdout.flush()
+    for buf in buffers:
+        view = memoryview(buf).cast("B")
+        for offset in range(0, len(view), chunk_size):
+            chunk = view[offset:offset + chunk_size]
+            sock.sendall(chunk)
+            sent += len(chunk)
+            throttle_and_report(sent, total, start_time, bw_bytes_per_sec, progress)
     
     if progress:
         sys.stdout.write('\n')
 
-def connect_to_server(host, port, max_retries, conn_timeout, op_timeout):
-    """Connect to the server with retries; return socket and file-like object."""
+def throttle_and_report(sent, total, start_time, bw_bytes_per_sec, progress):
+    """Sleep to keep the average rate under the limit and optionally draw a progress bar."""
+    elapsed = time.time() - start_time
+    expected = sent / bw_bytes_per_sec
+    if expected > elapsed:
+        time.sleep(expected - elapsed)
+    if progress:
+        percent = sent / total * 100
+        bar_length = 40
+        filled_length = int(round(bar_length * sent / total))
+        bar = '=' * filled_length + '-' * (bar_length - filled_length)
+        sys.stdout.write(f'\rProgress: [{bar}] {percent:6.2f}%')
+        sys.stdout.flush()
+
+def connect_to_server(host, port, max_retries, conn_timeout, op_timeout, max_line=line_proto.DEFAULT_MAX_LINE):
+    """Connect to the server with retries; return socket and line reader."""
     sock = None
     for attempt in range(1, max_retries + 1):
         try:
@@ -111,52 +312,61 @@ def connect_to_server(host, port, max_retries, conn_timeout, op_timeout):
         logging.error("Unable to connect to the server after multiple attempts.")
         sys.exit(1)
     sock.settimeout(op_timeout)
-    sock_file = sock.makefile('rwb')
-    return sock, sock_file
+    reader = line_proto.LineReader(sock.recv_into, max_line=max_line)
+    return sock, reader
 
-def process_response(response_line, command, debug):
+def read_response(reader):
+    """
+    Read one response line and split it into (status, data) bytes.
+    A closed connection yields an empty status.
     """
-    Process the response received from the server.
+    try:
+        response_line = reader.readline()
+    except line_proto.LineTooLong as e:
+        logging.error(f"Response rejected: {e} (see --max-line).")
+        sys.exit(1)
+    if response_line is None:
+        return b"", b""
+    parts = line_proto.split_fields(response_line.strip(), 1)
+    if len(parts) == 2:
+        return parts[0], parts[1]
+    return parts[0], b""
+
+def process_response(reader, command, debug):
+    """
+    Read and process the response received from the server.
     The response is expected to be in the format: STATUS<TAB>DATA.
     For INFO, the DATA is base64 encoded and will be decoded.
     - If debug is enabled, the STATUS (e.g. "OK" or "ERR") is sent to stderr.
     - The DATA (the actual message) is sent to stdout.
     """
-    parts = response_line.split("\t", 1)
-    if len(parts) == 2:
-        status, data = parts
-    else:
-        status = parts[0]
-        data = ""
+    status, data = read_response(reader)
     if command.upper() == "INFO":
         try:
-            data = base64.b64decode(data).decode("utf-8")
+            data = base64.b64decode(data)
         except Exception:
             pass
     if debug:
-        sys.stderr.write(status + "\n")
-    sys.stdout.write(data)
+        sys.stderr.write(status.decode("utf-8", "replace") + "\n")
+    sys.stdout.write(data.decode("utf-8", "replace"))
 
 def get_info(args):
     """
     Fetch the INFO command's output from the server as a YAML-formatted string.
     Returns the decoded INFO string.
     """
-    sock, sock_file = connect_to_server(args.ip, args.port, args.max_retries, args.conn_timeout, args.timeout)
+    sock, reader = connect_to_server(args.ip, args.port, args.max_retries, args.conn_timeout, args.timeout, args.max_line)
     try:
-        sock_file.write("INFO\n".encode("utf-8"))
-        sock_file.flush()
-        response_line = sock_file.readline().decode("utf-8").strip()
-        parts = response_line.split("\t", 1)
-        if len(parts) == 2 and parts[0] == "OK":
+        line_proto.send_line(sock, b"INFO")
+        status, data = read_response(reader)
+        if status == b"OK":
             try:
-                info_text = base64.b64decode(parts[1]).decode("utf-8")
+                info_text = base64.b64decode(data).decode("utf-8")
             except Exception:
-                info_text = parts[1]
+                info_text = data.decode("utf-8", "replace")
         else:
-            info_text = response_line
+            info_text = (status + b"\t" + data if data else status).decode("utf-8", "replace")
     finally:
-        sock_file.close()
         sock.close()
     return info_text
 
@@ -170,21 +380,20 @@ def bind_operation(folder_path, args):
     """
     host = args.ip
     port = args.port
-    sock, sock_file = connect_to_server(host, port, args.max_retries, args.conn_timeout, args.timeout)
+    sock, reader = connect_to_server(host, port, args.max_retries, args.conn_timeout, args.timeout, args.max_line)
     try:
         if os.path.isfile(folder_path) and folder_path.lower().endswith('.tar.gz'):
             with open(folder_path, "rb") as f:
                 file_data = f.read()
-            encoded_archive = base64.b64encode(file_data).decode('utf-8')
+            encoded_archive = base64.b64encode(file_data)
         else:
             archive_name = os.path.basename(os.path.normpath(folder_path))
-            encoded_archive = base64.b64encode(create_tar_gz_archive(folder_path, archive_name)).decode('utf-8')
-        bind_message = f"BIND\t{encoded_archive}\n".encode('utf-8')
-        send_rate_limited(sock_file, bind_message, args.bw_limit, progress=True)
-        response_line = sock_file.readline().decode('utf-8').strip()
-        process_response(response_line, "BIND", args.debug)
+            level = None if args.gzip_level == "auto" else int(args.gzip_level)
+            encoded_archive = base64.b64encode(create_tar_gz_archive(folder_path, archive_name, args.bw_limit, level))
+        bind_message = line_proto.line_buffers(b"BIND", encoded_archive)
+        send_rate_limited(sock, bind_message, args.bw_limit, progress=True)
+        process_response(reader, "BIND", args.debug)
     finally:
-        sock_file.close()
         sock.close()
 
 def flash_operation(archive_file, args):
@@ -194,18 +403,16 @@ def flash_operation(archive_file, args):
         sys.exit(1)
     host = args.ip
     port = args.port
-    sock, sock_file = connect_to_server(host, port, args.max_retries, args.conn_timeout, args.timeout)
+    sock, reader = connect_to_server(host, port, args.max_retries, args.conn_timeout, args.timeout, args.max_line)
     try:
         logging.debug(f"Reading archive file: {archive_file}")
         with open(archive_file, "rb") as f:
             file_data = f.read()
-        encoded_archive = base64.b64encode(file_data).decode("utf-8")
-        flash_message = f"FLASH\t{encoded_archive}\n".encode("utf-8")
-        send_rate_limited(sock_file, flash_message, args.bw_limit, progress=True)
-        response_line = sock_file.readline().decode("utf-8").strip()
-        process_response(response_line, "FLASH", args.debug)
+        encoded_archive = base64.b64encode(file_data)
+        flash_message = line_proto.line_buffers(b"FLASH", encoded_archive)
+        send_rate_limited(sock, flash_message, args.bw_limit, progress=True)
+        process_response(reader, "FLASH", args.debug)
     finally:
-        sock_file.close()
         sock.close()
 
 def simple_command_operation(command, args):
@@ -214,14 +421,11 @@ def simple_command_operation(command, args):
     Only the actual data message is output to stdout;
     any extra status (e.g. "OK" or "ERR") is sent to stderr when --debug is enabled.
     """
-    sock, sock_file = connect_to_server(args.ip, args.port, args.max_retries, args.conn_timeout, args.timeout)
+    sock, reader = connect_to_server(args.ip, args.port, args.max_retries, args.conn_timeout, args.timeout, args.max_line)
     try:
-        sock_file.write(f"{command}\n".encode("utf-8"))
-        sock_file.flush()
-        response_line = sock_file.readline().decode("utf-8").strip()
-        process_response(response_line, command, args.debug)
+        line_proto.send_line(sock, command)
+        process_response(reader, command, args.debug)
     finally:
-        sock_file.close()
         sock.close()
 
 def backup_operation(dest_folder, args):
@@ -271,16 +475,13 @@ def backup_operation(dest_folder, args):
     
     host = args.ip
     port = args.port
-    sock, sock_file = connect_to_server(host, port, args.max_retries, args.conn_timeout, args.timeout)
+    sock, reader = connect_to_server(host, port, args.max_retries, args.conn_timeout, args.timeout, args.max_line)
     try:
-        sock_file.write(b"BACKUP\n")
-        sock_file.flush()
-        response_line = sock_file.readline().decode("utf-8").strip()
-        parts = response_line.split("\t", 1)
-        if len(parts) < 2 or parts[0] != "OK":
-            logging.error("BACKUP command failed: " + (parts[1] if len(parts) > 1 else "No message"))
+        line_proto.send_line(sock, b"BACKUP")
+        status, encoded_data = read_response(reader)
+        if status != b"OK":
+            logging.error("BACKUP command failed: " + (encoded_data.decode("utf-8", "replace") or "No message"))
             sys.exit(1)
-        encoded_data = parts[1]
         try:
             decoded_data = base64.b64decode(encoded_data)
         except Exception as e:
@@ -308,7 +509,6 @@ def backup_operation(dest_folder, args):
         if args.debug:
             sys.stderr.write("BACKUP succeeded.\n")
     finally:
-        sock_file.close()
         sock.close()
 
 # -------------------- Main --------------------
@@ -327,7 +527,11 @@ def main():
     parser.add_argument("--max-retries", "-r", type=int, default=30, help="Max connection retries")
     parser.add_argument("--timeout", "-t", type=int, default=60, help="Socket timeout after connection")
     parser.add_argument("--conn-timeout", "-c", type=int, default=5, help="Timeout for connection attempt")
-    parser.add_argument("--bw-limit", type=int, default=2 * 1024 * 1024, help="Bandwidth limit in bits/sec")
+    parser.add_argument("--max-line", type=int, default=line_proto.DEFAULT_MAX_LINE, help="Largest accepted response line in bytes")
+    parser.add_argument("--bw-limit", type=int, default=DEFAULT_BW_LIMIT, help="Bandwidth limit in bits/sec")
+    parser.add_argument("--gzip-level", choices=["auto"] + [str(lvl) for lvl in range(10)], default="auto",
+                        help="gzip level for BIND folders; auto picks it from --bw-limit and CPU speed "
+                             "(members are stored or deflated per --bw-limit either way)")
     parser.add_argument("--debug", action="store_true", help="Enable debug output (sends extra info to stderr)")
     
     args = parser.parse_args()
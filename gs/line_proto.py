@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Tab-delimited line protocol helpers shared by connect.py and simple_alink_ctrl.py.
+
+Lines are kept as bytes end to end: received data lands in a bytearray via
+readinto/recv_into, lines are split off incrementally without decoding, and
+fields are split at the bytes level. Multi-MB base64 payloads (BIND, BACKUP)
+are therefore never turned into Python str.
+"""
+from collections import deque
+
+DEFAULT_MAX_LINE = 64 * 1024 * 1024  # Largest accepted line (bytes, without newline)
+RECV_SIZE = 65536                    # Bytes requested per recv_into/readinto call
+
+class LineTooLong(ValueError):
+    """Raised when a line exceeds the reader's max_line without a newline."""
+
+class LineReader:
+    """
+    Incremental line splitter on top of a readinto-style callable.
+
+    readinto is sock.recv_into for sockets or f.readinto for raw files; it must
+    fill the given buffer and return the number of bytes read (0 on EOF).
+    readline() returns one line as bytes without the trailing newline (a
+    trailing \\r is kept, use split_fields() to drop it), or None on EOF. An
+    unterminated final line is returned before EOF is reported.
+
+    A line longer than max_line raises LineTooLong in its place: lines before
+    it are returned first and lines after it are kept, so the caller can log
+    the error and keep reading. If the over-long line has no newline yet,
+    call discard_line() to skip the rest of it.
+    """
+    def __init__(self, readinto, max_line=DEFAULT_MAX_LINE, recv_size=RECV_SIZE):
+        self._readinto = readinto
+        self.max_line = max_line
+        self._buf = bytearray()
+        self._chunk = bytearray(recv_size)
+        self._view = memoryview(self._chunk)
+        self._lines = deque()   # Complete lines (or LineTooLong) split off but not returned yet
+        self._scan = 0          # Buffer offset already searched for a newline
+        self._eof = False
+        self._overflow = False  # LineTooLong raised before the line's newline arrived
+
+    def readline(self):
+        if not self._lines:
+            batch = self._fill()
+            if batch is None:
+                return None
+            self._lines.extend(batch)
+        line = self._lines.popleft()
+        if isinstance(line, LineTooLong):
+            raise line
+        return line
+
+    def __iter__(self):
+        while True:
+            while self._lines:
+                yield self.readline()
+            batch = self._fill()
+            if batch is None:
+                return
+            yield from batch
+
+    def _fill(self):
+        """
+        Read until at least one line is complete; return all complete lines, or
+        None on EOF. A batch with an over-long line is queued in _lines instead,
+        with a LineTooLong in place of that line, and an empty list is returned.
+        """
+        while True:
+            idx = self._buf.rfind(b"\n", self._scan)
+            if idx >= 0:
+                # Split every complete line in the buffer at once; a single
+                # large line is returned by split() without another copy.
+                with memoryview(self._buf) as view:
+                    block = bytes(view[:idx])
+                # Deleting from the front of a bytearray is amortised O(1).
+                del self._buf[:idx + 1]
+                self._scan = 0
+                lines = block.split(b"\n")
+                if max(map(len, lines)) > self.max_line:
+                    self._lines.extend(
+                        line if len(line) <= self.max_line else
+                        LineTooLong(f"line of {len(line)} bytes exceeds limit of {self.max_line}")
+                        for line in lines)
+                    return []
+                return lines
+            self._scan = len(self._buf)
+            if self._scan > self.max_line:
+                self._buf.clear()
+                self._scan = 0
+                self._overflow = True
+                raise LineTooLong(f"line exceeds limit of {self.max_line} bytes")
+            if self._eof:
+                if not self._buf:
+                    return None
+                line = bytes(self._buf)
+                self._buf.clear()
+                self._scan = 0
+                return [line]
+            n = self._readinto(self._view)
+            if not n:
+                self._eof = True
+                continue
+            self._buf += self._view[:n]
+
+    def discard_line(self):
+        """
+        After LineTooLong, drop the rest of the offending line up to its newline
+        so reading can continue with the next line.
+        """
+        if not self._overflow:
+            return
+        self._overflow = False
+        while True:
+            n = self._readinto(self._view)
+            if not n:
+                self._eof = True
+                return
+            idx = self._chunk.find(b"\n", 0, n)
+            if idx >= 0:
+                self._buf += self._view[idx + 1:n]
+                return
+
+def split_fields(line, maxsplit=-1):
+    """Split a received line into bytes fields on tabs, dropping a trailing \\r."""
+    return line.rstrip(b"\r").split(b"\t", maxsplit)
+
+def to_bytes(field):
+    """Encode a field for the wire; bytes-like objects pass through unchanged."""
+    if isinstance(field, (bytes, bytearray, memoryview)):
+        return field
+    return str(field).encode("utf-8")
+
+def line_buffers(*fields):
+    """
+    Return the buffers making up one line: fields separated by tabs and a
+    closing newline. Field payloads are referenced, not copied.
+    """
+    buffers = []
+    for field in fields:
+        buffers.append(to_bytes(field))
+        buffers.append(b"\t")
+    if buffers:
+        buffers[-1] = b"\n"
+    else:
+        buffers.append(b"\n")
+    return buffers
+
+def format_line(*fields):
+    """Join fields with tabs and terminate with a newline, in a single copy."""
+    return b"".join(line_buffers(*fields))
+
+def send_line(sock, *fields):
+    """
+    Send one line. Large fields are passed to sendmsg() as separate buffers
+    (scatter/gather) instead of being concatenated first.
+    """
+    send_buffers(sock, line_buffers(*fields))
+
+def send_buffers(sock, buffers):
+    """Send all buffers in order, using sendmsg() where the platform has it."""
+    if not hasattr(sock, "sendmsg"):
+        for buf in buffers:
+            sock.sendall(buf)
+        return
+    views = [memoryview(buf).cast("B") for buf in buffers if len(buf)]
+    while views:
+        sent = sock.sendmsg(views)
+        while views and sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        if sent:
+            views[0] = views[0][sent:]
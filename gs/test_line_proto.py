@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Tests for line_proto.LineReader. Run with: python3 -m unittest test_line_proto
+"""
+import io
+import unittest
+
+import line_proto
+
+def reader(data, max_line=50, recv_size=16):
+    return line_proto.LineReader(io.BytesIO(data).readinto, max_line=max_line, recv_size=recv_size)
+
+class LineReaderTest(unittest.TestCase):
+    def test_lines(self):
+        r = reader(b"a\tb\r\nc\nlast")
+        self.assertEqual(list(r), [b"a\tb\r", b"c", b"last"])
+
+    def test_too_long_line_in_batch_keeps_neighbours(self):
+        r = reader(b"a\n" + b"x" * 100 + b"\nb\n", recv_size=4096)
+        self.assertEqual(r.readline(), b"a")
+        with self.assertRaises(line_proto.LineTooLong):
+            r.readline()
+        r.discard_line()
+        self.assertEqual(r.readline(), b"b")
+        self.assertIsNone(r.readline())
+
+    def test_too_long_unterminated_line_is_discarded(self):
+        r = reader(b"a\n" + b"x" * 100 + b"\nb\n")
+        self.assertEqual(r.readline(), b"a")
+        with self.assertRaises(line_proto.LineTooLong):
+            r.readline()
+        r.discard_line()
+        self.assertEqual(r.readline(), b"b")
+        self.assertIsNone(r.readline())
+
+    def test_too_long_line_while_iterating(self):
+        r = reader(b"a\n" + b"x" * 100 + b"\nb\nc\n", recv_size=4096)
+        lines = []
+        with self.assertRaises(line_proto.LineTooLong):
+            for line in r:
+                lines.append(line)
+        self.assertEqual(lines, [b"a"])
+        self.assertEqual(list(r), [b"b", b"c"])
+
+if __name__ == "__main__":
+    unittest.main()
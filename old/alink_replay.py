@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Replay wfb-ng stats through the simple_alink_ctrl.py rate policies.
+
+Capture a stats stream on the GS with:  nc localhost 8103 > capture.jsonl
+Then compare policies with:             ./alink_replay.py capture.jsonl
+Without a file synthetic scenarios are generated instead: an RSSI fade, a
+gradual interference episode (fec_rec rises ahead of loss at unchanged
+RSSI) and an abrupt one (loss without a fec_rec ramp).
+
+Recorded loss does not depend on the bitrate we would have commanded, so the
+replay uses a link model driven by the recorded packet counters only, not by
+RSSI: the capacity of a sample is
+
+    link_bitrate / (1 + CAPACITY_FEC * fec_ratio + CAPACITY_LOST * lost_ratio)
+
+with fec_ratio = fec_rec/all and lost_ratio = lost/all. A sample is an
+overrun when the bitrate commanded after the previous sample is more than
+CAPACITY_MARGIN above its capacity; consecutive overruns form a burst.
+
+--check also replays the predictive policy with its fec_rec cut and with its
+lost cut disabled, and exits non-zero unless, against the rssi policy and
+each of those variants, the full policy has fewer overrun samples and no
+more bursts, and its mean bitrate is at most CHECK_BITRATE_MARGIN below the
+rssi policy's. It only shows that on the replayed samples the predictive
+cuts avoid overruns in this model without giving up most of the bitrate;
+it says nothing about a real link.
+"""
+import argparse
+import json
+import random
+import sys
+
+import simple_alink_ctrl as ctrl
+
+CAPACITY_FEC = 3.0      # Capacity loss per unit of fec_rec ratio
+CAPACITY_LOST = 12.0    # Capacity loss per unit of lost ratio
+CAPACITY_MARGIN = 0.05  # Tolerated overshoot before the model drops packets
+CHECK_BITRATE_MARGIN = 0.2  # Max mean bitrate shortfall of predictive vs rssi for --check
+
+def load_samples(path):
+    """Return the "video rx" messages from a captured JSON stats stream."""
+    samples = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if data.get("type") == "rx" and data.get("id") == "video rx" and data.get("rx_ant_stats"):
+                samples.append(data)
+    return samples
+
+def make_sample(rnd, rssi, fec, lost, antennas=2, total=1000):
+    ants = []
+    for ant in range(antennas):
+        value = rssi - 3 * ant + rnd.uniform(-1.5, 1.5)
+        ants.append({"ant": ant, "rssi_avg": int(round(value))})
+    return {"type": "rx", "id": "video rx",
+            "packets": {"all": [total, 0], "fec_rec": [int(fec), 0], "lost": [int(lost), 0]},
+            "rx_ant_stats": ants}
+
+def synthetic_scenarios(seed=1):
+    """
+    Generate three episodes separated by steady -55 dBm samples:
+    - fade: 30 samples down to -86 dBm, 10 at the bottom, 30 back up; fec_rec
+      rises below -70 dBm and packets are lost below -80 dBm.
+    - gradual interference: RSSI stays at -55 dBm, fec_rec ramps up over 10
+      samples, then packets are lost for 8 samples.
+    - abrupt interference: RSSI stays at -55 dBm, packets are lost for 6
+      samples without a preceding fec_rec ramp.
+    """
+    rnd = random.Random(seed)
+    samples = [make_sample(rnd, -55.0, rnd.uniform(0, 5), 0) for _ in range(20)]
+
+    fade = [-55.0 - 31.0 * i / 30 for i in range(1, 31)]
+    fade += [-86.0] * 10
+    fade += [-86.0 + 31.0 * i / 30 for i in range(1, 31)]
+    for rssi in fade:
+        fec = max(0.0, -70.0 - rssi) * 12 + rnd.uniform(0, 5)
+        lost = max(0.0, -80.0 - rssi) * 8 + (rnd.uniform(0, 4) if rssi < -80 else 0)
+        samples.append(make_sample(rnd, rssi, fec, lost))
+    samples += [make_sample(rnd, -55.0, rnd.uniform(0, 5), 0) for _ in range(15)]
+
+    for i in range(10):
+        samples.append(make_sample(rnd, -55.0, 15 * (i + 1) + rnd.uniform(0, 5), 0))
+    for _ in range(8):
+        samples.append(make_sample(rnd, -55.0, 150 + rnd.uniform(0, 10), 25 + rnd.uniform(0, 10)))
+    samples += [make_sample(rnd, -55.0, rnd.uniform(0, 5), 0) for _ in range(15)]
+
+    for _ in range(6):
+        samples.append(make_sample(rnd, -55.0, rnd.uniform(0, 5), 30 + rnd.uniform(0, 10)))
+    samples += [make_sample(rnd, -55.0, rnd.uniform(0, 5), 0) for _ in range(15)]
+    return samples
+
+def link_capacity(packets, link_bitrate):
+    """Capacity of one sample from its recorded fec_rec/lost ratios."""
+    total = ctrl.first_value(packets, "all")
+    if total <= 0:
+        return link_bitrate
+    fec_ratio = ctrl.first_value(packets, "fec_rec") / total
+    lost_ratio = ctrl.first_value(packets, "lost") / total
+    return link_bitrate / (1 + CAPACITY_FEC * fec_ratio + CAPACITY_LOST * lost_ratio)
+
+def replay(samples, policy, link_bitrate):
+    """Run samples through a policy; return a dict of link-model results."""
+    ctrl.POLICY = policy
+    ctrl.reset_policy_state()
+    commanded = None
+    overruns = 0
+    bursts = 0
+    in_burst = False
+    bitrate_sum = 0
+    for data in samples:
+        ant_stats = data["rx_ant_stats"]
+        packets = data.get("packets", {})
+        if commanded is not None:
+            overrun = commanded > link_capacity(packets, link_bitrate) * (1 + CAPACITY_MARGIN)
+            if overrun:
+                overruns += 1
+                if not in_burst:
+                    bursts += 1
+            in_burst = overrun
+        bitrate, _ = ctrl.compute_targets(ant_stats, packets)
+        commanded = bitrate
+        bitrate_sum += bitrate
+    return {
+        "samples": len(samples),
+        "mean_bitrate": int(bitrate_sum / len(samples)) if samples else 0,
+        "overrun_samples": overruns,
+        "bursts": bursts,
+    }
+
+def replay_variant(samples, link_bitrate, **overrides):
+    """Replay the predictive policy with some controller parameters overridden."""
+    saved = {name: getattr(ctrl, name) for name in overrides}
+    for name, value in overrides.items():
+        setattr(ctrl, name, value)
+    try:
+        return replay(samples, "predictive", link_bitrate)
+    finally:
+        for name, value in saved.items():
+            setattr(ctrl, name, value)
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay wfb-ng stats through alink rate policies")
+    parser.add_argument("file", nargs="?", help="Captured JSON stats stream (default: synthetic scenarios)")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the synthetic scenarios (default: 1)")
+    parser.add_argument("--link_bitrate", type=int, default=ctrl.BITRATE_HIGH,
+                        help=f"Link capacity with no fec_rec/lost (default: {ctrl.BITRATE_HIGH})")
+    parser.add_argument("--check", action="store_true",
+                        help="Fail unless the predictive fec_rec and lost cuts each reduce overruns "
+                             "without adding bursts or losing more than "
+                             f"{int(CHECK_BITRATE_MARGIN * 100)}%% of the rssi mean bitrate")
+    parser.add_argument("--verbose", type=int, default=0, help="Verbosity passed to the controller log()")
+    args = parser.parse_args()
+
+    ctrl.VERBOSITY = args.verbose
+    samples = load_samples(args.file) if args.file else synthetic_scenarios(args.seed)
+    if not samples:
+        sys.stderr.write("No video rx samples to replay.\n")
+        sys.exit(1)
+
+    results = [
+        ("rssi", replay(samples, "rssi", args.link_bitrate)),
+        ("predictive", replay(samples, "predictive", args.link_bitrate)),
+    ]
+    if args.check:
+        results.append(("pred no-fec", replay_variant(samples, args.link_bitrate, PRED_FEC_SLOPE=float("inf"))))
+        results.append(("pred no-lost", replay_variant(samples, args.link_bitrate, PRED_LOSS_CUT=1.0)))
+
+    print(f"{'policy':<14}{'samples':>8}{'mean kbps':>11}{'overruns':>10}{'bursts':>8}")
+    for name, r in results:
+        print(f"{name:<14}{r['samples']:>8}{r['mean_bitrate']:>11}{r['overrun_samples']:>10}{r['bursts']:>8}")
+
+    if args.check:
+        predictive = results[1][1]
+        failed = []
+        for name, r in results:
+            if name == "predictive":
+                continue
+            if r["overrun_samples"] <= predictive["overrun_samples"]:
+                failed.append(f"{name} has no more overruns")
+            if r["bursts"] < predictive["bursts"]:
+                failed.append(f"{name} has fewer bursts")
+        min_bitrate = results[0][1]["mean_bitrate"] * (1 - CHECK_BITRATE_MARGIN)
+        if predictive["mean_bitrate"] < min_bitrate:
+            failed.append(f"predictive mean bitrate is below {int(min_bitrate)}")
+        if failed:
+            sys.stderr.write(f"CHECK FAILED: {'; '.join(failed)}\n")
+            sys.exit(1)
+        print("CHECK OK")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+../gs/line_proto.py
\ No newline at end of file
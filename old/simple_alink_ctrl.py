@@ -5,10 +5,16 @@ import sys
 import time
 import threading
 import argparse
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# line_proto.py (from gs/) must be deployed next to this script.
+import line_proto
 
 # --- Global Configuration (defaults) ---
 HOST = 'localhost'
 PORT = 8103
+STATS_MAX_LINE = 1024 * 1024  # Longest accepted stats/ACK line in bytes
 
 # Mapping parameters for BITRATE (adjustable):
 RS_RSSI_HIGH = -50    # strongest signal (dBm)
@@ -27,6 +33,66 @@ REC_THRESHOLD_FEC = 0  # Default threshold for fec_rec (if > this, trigger)
 REC_THRESHOLD_LOST = 0  # Default threshold for lost (if > this, trigger)
 REC_LOST_SAMPLE_SIZE = 5  # Number of samples to keep for REC_LOST calculation
 rec_lost_samples = []      # Global list for REC_LOST samples
+rssi_history = []          # Global list for the RSSI moving average
+
+# Rate control policy: "rssi" follows the moving average of the best antenna,
+# "predictive" also reacts to fec_rec/lost trends and the RSSI slope.
+POLICY = "rssi"
+RSSI_AVG_WINDOW = 5       # Samples in the RSSI moving average (rssi policy)
+
+# Predictive policy parameters:
+PRED_WINDOW = 5           # Samples used for RSSI and fec/lost slopes
+PRED_HORIZON = 3          # Samples ahead to extrapolate a falling RSSI
+PRED_FEC_SLOPE = 0.01     # Rise in fec_rec ratio per sample that triggers a cut
+PRED_FEC_CUT = 0.75       # Bitrate factor applied on a rising fec_rec trend
+PRED_LOSS_CUT = 0.5       # Bitrate factor applied when packets are lost
+PRED_LOST_RATIO = 0.005   # Lost/all ratio above which PRED_LOSS_CUT applies
+                          # (0.5%, i.e. 5 of 1000 packets like the drone's BAD_LOST_THRESHOLD)
+PRED_RAMP_HOLD = 3        # Clean samples required before ramping up
+PRED_RAMP_STEP = 1000     # Max bitrate increase per sample while ramping up
+
+# Predictive policy state (reset on failsafe entry).
+pred_rssi = {}                               # antenna id -> deque of rssi_avg
+pred_fec = deque(maxlen=PRED_WINDOW)         # fec_rec ratio per sample
+pred_state = {"bitrate": None, "clean": 0}   # last commanded bitrate, clean streak
+
+# Stall watchdog and failsafe parameters:
+STALL_TIMEOUT_MS = 2000       # No "video rx" stats within this window => stall
+FAILSAFE_BITRATE = 4500       # Conservative bitrate pushed on stall/disconnect
+                              # (simple_alink.sh clamps anything below MIN_ACCEPTABLE_BITRATE=4500)
+FAILSAFE_TX_PWR = TX_PWR_HIGH # Max TX power pushed on stall/disconnect
+RECONNECT_INITIAL = 0.1       # First reconnect delay in seconds
+RECONNECT_MAX = 3.0           # Reconnect backoff cap in seconds
+
+# Failsafe state (only touched by the socket listener thread).
+failsafe_active = False
+failsafe_since = 0.0
+failsafe_last_push = 0.0
+
+# Counters exposed as metrics.
+metrics = {
+    "stalls": 0,            # stats cadence missed while connected
+    "disconnects": 0,       # stats stream closed or errored
+    "reconnects": 0,        # successful reconnections
+    "failsafe_entries": 0,  # times the failsafe profile was pushed on entry
+    "failsafe_time": 0.0,   # accumulated seconds spent in failsafe
+    "messages": 0,          # JSON stats messages received
+    "parse_time": 0.0,      # accumulated seconds spent in json.loads
+    "queue_lag": 0.0,       # seconds between wfb-ng timestamp and our read (last message)
+    "acks": 0,              # ACKs matched to a sent command
+    "ack_rtt": 0.0,         # last ACK round trip in seconds
+    "ack_rtt_total": 0.0,   # accumulated ACK round trip in seconds
+    "rssi": None,           # best rssi_avg of the last video rx sample
+    "bitrate": None,        # last BITRATE sent
+    "tx_power": None,       # last TX_PWR sent
+}
+sent_counts = {}      # command -> number of commands sent
+message_times = deque(maxlen=4096)  # arrival times of recent stats messages
+RATE_WINDOW = 1.0     # seconds covered by messages_per_sec
+pending_acks = {}     # seq -> (command, send time) awaiting an ACK
+PENDING_ACKS_MAX = 256
+metrics_lock = threading.Lock()
+METRICS_PORT = 0      # HTTP metrics endpoint on localhost (0: disabled)
 
 # Global sequence number for all commands sent.
 seq_num = 0
@@ -45,40 +111,43 @@ udp_port = None
 # Global shutdown event.
 shutdown_event = threading.Event()
 
-def log(level, msg):
+def log(level, msg, *args):
     """
     Print debug messages if the current verbosity level is high enough.
+    level 0: Always printed (errors the user must see, e.g. a requested endpoint is unavailable)
     level 1: Important messages (commands sent, ACK received, errors)
     level 2: Detailed messages (socket connection, packet details, etc.)
+    Arguments are %-formatted only when the message is printed, so disabled
+    levels cost a single comparison on the hot path.
     """
-    if VERBOSITY >= level:
-        sys.stderr.write(msg + "\n")
+    if VERBOSITY < level:
+        return
+    if args:
+        msg = msg % args
+    sys.stderr.write(msg + "\n")
 
-def safe_send(line):
+def safe_send(frame):
     """
-    Attempt to send a line.
+    Attempt to send a newline-terminated frame (bytes, see line_proto.format_line).
     In UDP mode, send it as a UDP packet to the configured destination.
     Otherwise, write to stdout.
     If an error occurs, log it, set shutdown_event, and return False.
     """
     if UDP_MODE:
         try:
-            # Append newline so that receivers (e.g. netcat) see a complete line.
-            if not line.endswith("\n"):
-                line += "\n"
-            udp_socket.sendto(line.encode('utf-8'), (udp_ip, udp_port))
+            udp_socket.sendto(frame, (udp_ip, udp_port))
             return True
         except Exception as e:
-            log(1, f"[safe_send] UDP send failed: {e} for line: {line}")
+            log(1, "[safe_send] UDP send failed: %s for line: %r", e, frame)
             shutdown_event.set()
             return False
     else:
         try:
-            print(line)
+            sys.stdout.buffer.write(frame)
             sys.stdout.flush()
             return True
         except BrokenPipeError:
-            log(1, f"[safe_send] Broken pipe encountered when sending: {line}")
+            log(1, "[safe_send] Broken pipe encountered when sending: %r", frame)
             shutdown_event.set()
             return False
 
@@ -121,88 +190,340 @@ def map_rssi_to_tx_power(rssi, tx_rssi_min=TX_RSSI_MIN, tx_rssi_max=TX_RSSI_MAX,
     tx_power = tx_power_high - ratio * (tx_power_high - tx_power_low)
     return int(round(tx_power))
 
+def slope(samples):
+    """
+    Least-squares slope of evenly spaced samples (units per sample).
+    Returns 0.0 for fewer than two samples.
+    """
+    n = len(samples)
+    if n < 2:
+        return 0.0
+    mean_x = (n - 1) / 2.0
+    mean_y = sum(samples) / n
+    num = sum((i - mean_x) * (y - mean_y) for i, y in enumerate(samples))
+    den = sum((i - mean_x) ** 2 for i in range(n))
+    return num / den
+
+def first_value(packets, key):
+    """Return the per-interval counter packets[key][0], or 0 if absent."""
+    value = packets.get(key)
+    if isinstance(value, list) and len(value) > 0:
+        return value[0]
+    return 0
+
+def reset_policy_state(bitrate=None):
+    """
+    Forget RSSI/fec history so stale samples do not drive new decisions.
+    If a bitrate is given, the predictive policy ramps up from it.
+    """
+    rssi_history.clear()
+    rec_lost_samples.clear()
+    pred_rssi.clear()
+    pred_fec.clear()
+    pred_state["bitrate"] = bitrate
+    pred_state["clean"] = 0
+
+def rssi_policy(ant_stats):
+    """
+    Map the moving average of the best antenna's rssi_avg to bitrate and TX power.
+    """
+    best_ant = max(ant_stats, key=lambda ant: ant.get("rssi_avg", -1000))
+    best_rssi = best_ant.get("rssi_avg", -1000)
+    log(2, "[SOCKET] Best antenna stats: %s", best_ant)
+
+    # --- Update moving average for RSSI ---
+    # (Append new best_rssi; remove oldest if window exceeded)
+    rssi_history.append(best_rssi)
+    if len(rssi_history) > RSSI_AVG_WINDOW:
+        rssi_history.pop(0)
+    avg_rssi = round(sum(rssi_history) / len(rssi_history))
+    log(2, "[SOCKET] Updated RSSI moving average: %s (history: %s)", avg_rssi, rssi_history)
+
+    # --- Compute commands using moving average ---
+    target_bitrate = map_rssi_to_bitrate(avg_rssi)
+    target_tx_power = map_rssi_to_tx_power(avg_rssi)
+    log(2, "[SOCKET] Using avg RSSI: %s dBm, computed BITRATE: %s, computed TX_PWR: %s", avg_rssi, target_bitrate, target_tx_power)
+    return target_bitrate, target_tx_power
+
+def predictive_policy(ant_stats, packets):
+    """
+    Cut bitrate before RSSI has fully dropped, and ramp back up carefully.
+    - RSSI: the best antenna's rssi_avg is extrapolated PRED_HORIZON samples
+      ahead with the mean slope of all antennas (only when falling).
+    - fec_rec: a rising ratio of FEC-recovered packets cuts by PRED_FEC_CUT.
+    - lost: a lost ratio above PRED_LOST_RATIO cuts by PRED_LOSS_CUT; smaller
+      losses neither cut nor end the clean streak.
+    Increases are only allowed after PRED_RAMP_HOLD clean samples and are
+    limited to PRED_RAMP_STEP per sample; decreases apply immediately.
+    """
+    seen = set()
+    for ant in ant_stats:
+        ant_id = ant.get("ant", id(ant))
+        history = pred_rssi.get(ant_id)
+        if history is None:
+            history = pred_rssi[ant_id] = deque(maxlen=PRED_WINDOW)
+        history.append(ant.get("rssi_avg", -1000))
+        seen.add(ant_id)
+    # Antennas that disappeared from the stats no longer describe the link.
+    for ant_id in list(pred_rssi):
+        if ant_id not in seen:
+            del pred_rssi[ant_id]
+
+    best_rssi = max(history[-1] for history in pred_rssi.values())
+    rssi_slope = sum(slope(history) for history in pred_rssi.values()) / len(pred_rssi)
+    projected_rssi = best_rssi + min(rssi_slope, 0.0) * PRED_HORIZON
+
+    fec = first_value(packets, "fec_rec")
+    lost = first_value(packets, "lost")
+    total = first_value(packets, "all")
+    pred_fec.append(fec / total if total > 0 else 0.0)
+    fec_slope = slope(pred_fec)
+    lost_ratio = lost / total if total > 0 else 0.0
+
+    target_bitrate = map_rssi_to_bitrate(projected_rssi)
+    target_tx_power = map_rssi_to_tx_power(projected_rssi)
+
+    current = pred_state["bitrate"]
+    if current is not None:
+        if lost_ratio > PRED_LOST_RATIO:
+            target_bitrate = min(target_bitrate, int(current * PRED_LOSS_CUT))
+            pred_state["clean"] = 0
+        elif fec_slope > PRED_FEC_SLOPE:
+            target_bitrate = min(target_bitrate, int(current * PRED_FEC_CUT))
+            pred_state["clean"] = 0
+        else:
+            pred_state["clean"] += 1
+        if target_bitrate > current:
+            if pred_state["clean"] < PRED_RAMP_HOLD:
+                target_bitrate = current
+            else:
+                target_bitrate = min(target_bitrate, current + PRED_RAMP_STEP)
+    target_bitrate = max(BITRATE_LOW, min(BITRATE_HIGH, target_bitrate))
+    pred_state["bitrate"] = target_bitrate
+
+    log(2, "[PREDICT] best RSSI: %s, slope: %.2f dB/sample, projected: %.1f, "
+           "fec ratio slope: %.4f, lost: %s, computed BITRATE: %s, computed TX_PWR: %s",
+        best_rssi, rssi_slope, projected_rssi, fec_slope, lost, target_bitrate, target_tx_power)
+    return target_bitrate, target_tx_power
+
+def compute_targets(ant_stats, packets):
+    """
+    Return (bitrate, tx_power) for one "video rx" sample using POLICY.
+    """
+    if POLICY == "predictive":
+        return predictive_policy(ant_stats, packets)
+    return rssi_policy(ant_stats)
+
+def send_command(command, *fields):
+    """
+    Send a tab-delimited command with the next sequence number.
+    Format: COMMAND<TAB>sequence<TAB>field...
+    Sent commands are counted and remembered until ACKed for RTT metrics.
+    Returns True if the command was sent.
+    """
+    seq = get_next_seq()
+    frame = line_proto.format_line(command, seq, *fields)
+    if not safe_send(frame):
+        return False
+    with metrics_lock:
+        sent_counts[command] = sent_counts.get(command, 0) + 1
+        if not UDP_MODE:
+            if len(pending_acks) >= PENDING_ACKS_MAX:
+                pending_acks.pop(next(iter(pending_acks)))
+            pending_acks[seq] = (command, time.monotonic())
+    if VERBOSITY >= 1:
+        log(1, "[CMD SENT] %s", frame[:-1].decode("utf-8", "replace"))
+    return True
+
 def send_bitrate(bitrate):
     """
     Send a BITRATE command with the computed bitrate.
     Format: BITRATE<TAB>sequence<TAB>bitrate
     """
-    seq = get_next_seq()
-    command_str = f"BITRATE\t{seq}\t{bitrate}"
-    if safe_send(command_str):
-        log(1, f"[CMD SENT] {command_str}")
+    if send_command("BITRATE", bitrate):
+        metrics_set("bitrate", bitrate)
 
 def send_tx_power(tx_power):
     """
     Send a TX_PWR command with the computed TX power.
     Format: TX_PWR<TAB>sequence<TAB>tx_power
     """
-    seq = get_next_seq()
-    command_str = f"TX_PWR\t{seq}\t{tx_power}"
-    if safe_send(command_str):
-        log(1, f"[CMD SENT] {command_str}")
+    if send_command("TX_PWR", tx_power):
+        metrics_set("tx_power", tx_power)
 
 def send_rec_lost(fec_val, lost_val):
     """
     Send a REC_LOST command with the given fec_rec and lost values.
     Format: REC_LOST<TAB>sequence<TAB>fec_val<TAB>lost_val
     """
-    seq = get_next_seq()
-    command_str = f"REC_LOST\t{seq}\t{fec_val}\t{lost_val}"
-    if safe_send(command_str):
-        log(1, f"[CMD SENT] {command_str}")
+    send_command("REC_LOST", fec_val, lost_val)
 
 def send_heartbeat():
     """
     Send a HEARTBEAT command.
     Format: HEARTBEAT<TAB>sequence<TAB>Heartbeat received
     """
-    seq = get_next_seq()
-    command_str = f"HEARTBEAT\t{seq}\tHeartbeat received"
-    if safe_send(command_str):
-        log(1, f"[CMD SENT] {command_str}")
+    send_command("HEARTBEAT", "Heartbeat received")
 
 def send_info(info):
     """
     Placeholder for sending an INFO command.
     """
-    seq = get_next_seq()
-    command_str = f"INFO\t{seq}\t{info}"
-    if safe_send(command_str):
-        log(1, f"[CMD SENT] {command_str}")
+    send_command("INFO", info)
 
 def send_status(status):
     """
     Placeholder for sending a STATUS command.
     """
-    seq = get_next_seq()
-    command_str = f"STATUS\t{seq}\t{status}"
-    if safe_send(command_str):
-        log(1, f"[CMD SENT] {command_str}")
+    send_command("STATUS", status)
 
 def send_command_action(action):
     """
     Placeholder for sending a COMMAND command.
     For example, action can be ENABLE, DISABLE, RESET, etc.
     """
-    seq = get_next_seq()
-    command_str = f"COMMAND\t{seq}\t{action}"
-    if safe_send(command_str):
-        log(1, f"[CMD SENT] {command_str}")
+    send_command("COMMAND", action)
+
+def metrics_inc(key, amount=1):
+    with metrics_lock:
+        metrics[key] += amount
+
+def metrics_set(key, value):
+    with metrics_lock:
+        metrics[key] = value
+
+def get_metrics():
+    """
+    Return a snapshot of the metrics counters.
+    time-in-failsafe includes the currently running failsafe period, if any.
+    """
+    with metrics_lock:
+        snapshot = dict(metrics)
+        # Computed at snapshot time so the rate drops to 0 while stats are stalled.
+        now = time.monotonic()
+        while message_times and now - message_times[0] > RATE_WINDOW:
+            message_times.popleft()
+        snapshot["messages_per_sec"] = len(message_times) / RATE_WINDOW
+        for command, count in sent_counts.items():
+            snapshot["sent_" + command.lower()] = count
+    if failsafe_active:
+        snapshot["failsafe_time"] += time.monotonic() - failsafe_since
+    snapshot["failsafe_active"] = failsafe_active
+    snapshot["ack_rtt_avg"] = snapshot["ack_rtt_total"] / snapshot["acks"] if snapshot["acks"] else 0.0
+    snapshot["parse_time_avg"] = snapshot["parse_time"] / snapshot["messages"] if snapshot["messages"] else 0.0
+    return snapshot
+
+def format_metrics_text(snapshot):
+    """
+    Render a metrics snapshot as "alink_<name> <value>" lines.
+    Values that are not known yet (None) are omitted.
+    """
+    lines = []
+    for key, value in sorted(snapshot.items()):
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            value = int(value)
+        lines.append(f"alink_{key} {value}")
+    return "\n".join(lines) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Serve GET /metrics (text) and GET /metrics.json from a metrics snapshot.
+    """
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = format_metrics_text(get_metrics()).encode("utf-8")
+            content_type = "text/plain; charset=utf-8"
+        elif self.path == "/metrics.json":
+            body = json.dumps(get_metrics()).encode("utf-8")
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log(2, "[METRICS] " + format, *args)
+
+def metrics_server(port):
+    """
+    Serve the metrics endpoint on localhost until shutdown.
+    """
+    try:
+        server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    except OSError as e:
+        log(0, "[METRICS] Failed to listen on 127.0.0.1:%s: %s (metrics disabled)", port, e)
+        return
+    server.daemon_threads = True
+    log(1, "[METRICS] Serving http://127.0.0.1:%s/metrics", port)
+    server.serve_forever()
+
+def enter_failsafe(reason):
+    """
+    Push the failsafe profile (low bitrate, max TX power).
+    On entry the profile is sent immediately; while failsafe stays active it is
+    re-sent at most once per stall timeout so a lost UDP packet cannot leave
+    the drone on its last aggressive settings.
+    """
+    global failsafe_active, failsafe_since, failsafe_last_push
+    now = time.monotonic()
+    if not failsafe_active:
+        failsafe_active = True
+        failsafe_since = now
+        metrics_inc("failsafe_entries")
+        # Stale samples must not drive the first decisions after recovery.
+        # The predictive ramp starts at BITRATE_LOW at the least, since the
+        # policy never commands less; a lower seed would be clamped up on the
+        # first sample and skip PRED_RAMP_HOLD.
+        reset_policy_state(max(FAILSAFE_BITRATE, BITRATE_LOW))
+        log(1, "[FAILSAFE] Entering failsafe (%s): BITRATE %s, TX_PWR %s", reason, FAILSAFE_BITRATE, FAILSAFE_TX_PWR)
+    elif now - failsafe_last_push < STALL_TIMEOUT_MS / 1000.0:
+        return
+    failsafe_last_push = now
+    send_bitrate(FAILSAFE_BITRATE)
+    send_tx_power(FAILSAFE_TX_PWR)
+
+def exit_failsafe():
+    """Leave failsafe once stats are flowing again and account the time spent."""
+    global failsafe_active
+    if not failsafe_active:
+        return
+    duration = time.monotonic() - failsafe_since
+    metrics_inc("failsafe_time", duration)
+    failsafe_active = False
+    if VERBOSITY >= 1:
+        log(1, "[FAILSAFE] Stats recovered after %.2fs, leaving failsafe. Metrics: %s", duration, get_metrics())
 
 def parse_ack_message(line):
     """
-    Parse an ack message from STDIN and echo it.
+    Parse an ack message (bytes) from STDIN and echo it.
     Expected ack format (tab-delimited):
       ACK:COMMAND_TYPE<TAB>sequence<TAB>message
     """
-    parts = line.strip().split('\t')
+    parts = line_proto.split_fields(line.strip())
     if len(parts) < 3:
-        log(1, f"[ACK PARSER] Invalid ack format: {line.strip()}")
+        log(1, "[ACK PARSER] Invalid ack format: %.200r", line.strip())
         return
-    command = parts[0]
-    seq = parts[1]
-    msg = parts[2]
-    log(1, f"[ACK RECEIVED] Command: {command}, Seq: {seq}, Msg: {msg}")
+    command = parts[0].decode("utf-8", "replace")
+    seq = parts[1].decode("utf-8", "replace")
+    msg = parts[2].decode("utf-8", "replace")
+    try:
+        seq_val = int(parts[1])
+    except ValueError:
+        seq_val = None
+    with metrics_lock:
+        pending = pending_acks.pop(seq_val, None)
+        if pending is not None:
+            rtt = time.monotonic() - pending[1]
+            metrics["acks"] += 1
+            metrics["ack_rtt"] = rtt
+            metrics["ack_rtt_total"] += rtt
+    log(1, "[ACK RECEIVED] Command: %s, Seq: %s, Msg: %s", command, seq, msg)
 
 def ack_listener():
     """
@@ -211,9 +532,16 @@ def ack_listener():
     In UDP mode, ignore EOF (i.e. do not shut down).
     """
     log(2, "[ACK LISTENER] Started.")
+    reader = line_proto.LineReader(sys.stdin.buffer.raw.readinto, max_line=STATS_MAX_LINE)
     while not shutdown_event.is_set():
-        line = sys.stdin.readline()
-        if not line:
+        try:
+            line = reader.readline()
+        except line_proto.LineTooLong as e:
+            # Skip the rest of the line and keep listening; a bad ACK must not stop rate control.
+            log(1, "[ACK PARSER] Invalid ack format: %s. Line discarded.", e)
+            reader.discard_line()
+            continue
+        if line is None:
             if UDP_MODE:
                 log(2, "[ACK LISTENER] EOF on STDIN, but in UDP mode. Ignoring.")
                 time.sleep(1)
@@ -227,32 +555,59 @@ def ack_listener():
 def socket_listener():
     """
     Connect to the JSON stream on port 8103 and process incoming JSON messages.
-    If the connection is lost, reconnect every 3 seconds.
+    A watchdog expects a "video rx" message at least every STALL_TIMEOUT_MS.
+    On a stall or disconnect the failsafe profile is pushed immediately and the
+    connection is re-established with fast initial retries and capped backoff.
     """
-    global rssi_history, rec_lost_samples
+    stall_timeout = STALL_TIMEOUT_MS / 1000.0
+    delay = RECONNECT_INITIAL
+    connected_once = False
     while not shutdown_event.is_set():
         try:
-            log(2, f"[SOCKET] Connecting to JSON stream at {HOST}:{PORT}...")
-            sock = socket.create_connection((HOST, PORT))
+            log(2, "[SOCKET] Connecting to JSON stream at %s:%s...", HOST, PORT)
+            sock = socket.create_connection((HOST, PORT), timeout=stall_timeout)
         except Exception as e:
-            log(2, f"[SOCKET] Failed to connect: {e}. Retrying in 3 seconds...")
-            time.sleep(3)
+            log(2, "[SOCKET] Failed to connect: %s. Retrying in %.2f seconds...", e, delay)
+            if connected_once:
+                enter_failsafe("stats unavailable")
+            shutdown_event.wait(delay)
+            delay = min(delay * 2, RECONNECT_MAX)
             continue
 
+        if connected_once:
+            metrics_inc("reconnects")
+        connected_once = True
         log(2, "[SOCKET] Connected. Listening for JSON messages...")
+        # The socket timeout makes the reader wake up when the stream goes silent.
+        sock.settimeout(stall_timeout)
+        last_stats = time.monotonic()
         try:
-            stream = sock.makefile('r')
+            stream = line_proto.LineReader(sock.recv_into, max_line=STATS_MAX_LINE)
             for line in stream:
                 if shutdown_event.is_set():
                     break
+                now = time.monotonic()
+                # Other message types keep the socket alive; only video rx counts.
+                if now - last_stats > stall_timeout:
+                    raise socket.timeout("no video rx stats")
                 line = line.strip()
                 if not line:
                     continue
+                parse_start = time.perf_counter()
                 try:
                     data = json.loads(line)
                 except json.JSONDecodeError as e:
-                    log(2, f"[SOCKET] JSON decode error: {e}")
+                    log(2, "[SOCKET] JSON decode error: %s", e)
                     continue
+                parse_time = time.perf_counter() - parse_start
+
+                with metrics_lock:
+                    metrics["messages"] += 1
+                    metrics["parse_time"] += parse_time
+                    timestamp = data.get("timestamp")
+                    if isinstance(timestamp, (int, float)):
+                        metrics["queue_lag"] = time.time() - timestamp
+                    message_times.append(now)
 
                 # Skip the one-time "settings" message.
                 if data.get("type") == "settings":
@@ -263,6 +618,9 @@ def socket_listener():
                 if data.get("type") == "rx":
                     msg_id = data.get("id", "")
                     if msg_id == "video rx":
+                        last_stats = time.monotonic()
+                        delay = RECONNECT_INITIAL
+                        exit_failsafe()
                         # --- Process "packets" for REC_LOST ---
                         packets = data.get("packets", {})
                         if packets:
@@ -293,55 +651,56 @@ def socket_listener():
                             log(2, "[SOCKET] No rx_ant_stats available.")
                             continue
 
-                        best_ant = max(ant_stats, key=lambda ant: ant.get("rssi_avg", -1000))
-                        best_rssi = best_ant.get("rssi_avg", -1000)
-                        log(2, f"[SOCKET] Best antenna stats: {best_ant}")
-
-                        # --- Update moving average for RSSI ---
-                        # (Append new best_rssi; remove oldest if window exceeded)
-                        rssi_history.append(best_rssi)
-                        if len(rssi_history) > 5:
-                            rssi_history.pop(0)
-                        avg_rssi = round(sum(rssi_history) / len(rssi_history))
-                        log(2, f"[SOCKET] Updated RSSI moving average: {avg_rssi} (history: {rssi_history})")
+                        metrics_set("rssi", max(ant.get("rssi_avg", -1000) for ant in ant_stats))
 
-                        # --- Compute commands using moving average ---
-                        target_bitrate = map_rssi_to_bitrate(avg_rssi)
-                        target_tx_power = map_rssi_to_tx_power(avg_rssi)
-                        log(2, f"[SOCKET] Using avg RSSI: {avg_rssi} dBm, computed BITRATE: {target_bitrate}, computed TX_PWR: {target_tx_power}")
+                        # --- Compute commands with the selected policy ---
+                        target_bitrate, target_tx_power = compute_targets(ant_stats, packets)
 
                         # --- Send BITRATE and TX_PWR commands ---
                         send_bitrate(target_bitrate)
                         send_tx_power(target_tx_power)
                     else:
-                        log(2, f"[SOCKET] Received rx message with id '{msg_id}'. Placeholder processing...")
+                        log(2, "[SOCKET] Received rx message with id '%s'. Placeholder processing...", msg_id)
                 else:
-                    log(2, f"[SOCKET] Received message of type '{data.get('type')}'. Placeholder processing...")
+                    log(2, "[SOCKET] Received message of type '%s'. Placeholder processing...", data.get('type'))
+            else:
+                if not shutdown_event.is_set():
+                    log(2, "[SOCKET] JSON stream closed by peer.")
+                    metrics_inc("disconnects")
+                    enter_failsafe("stats stream closed")
+        except socket.timeout:
+            log(1, "[SOCKET] No video rx stats within %s ms. Reconnecting...", STALL_TIMEOUT_MS)
+            metrics_inc("stalls")
+            enter_failsafe("stats stall")
         except Exception as e:
-            log(2, f"[SOCKET] Exception while reading JSON stream: {e}. Reconnecting in 3 seconds...")
+            log(2, "[SOCKET] Exception while reading JSON stream: %s. Reconnecting in %.2f seconds...", e, delay)
+            metrics_inc("disconnects")
+            enter_failsafe("stats stream error")
         finally:
             try:
                 sock.close()
             except Exception:
                 pass
-            time.sleep(3)
+        shutdown_event.wait(delay)
+        delay = min(delay * 2, RECONNECT_MAX)
+
 
 def heartbeat_sender(interval):
     """
     Periodically send HEARTBEAT messages every 'interval' seconds.
     """
-    log(2, f"[HEARTBEAT] Started with interval {interval} seconds.")
+    log(2, "[HEARTBEAT] Started with interval %s seconds.", interval)
     while not shutdown_event.is_set():
         send_heartbeat()
         time.sleep(interval)
 
 def main():
     global VERBOSITY, HEARTBEAT_INTERVAL, UDP_MODE, udp_socket, udp_ip, udp_port
-    global rec_lost_samples, rssi_history
+    global STALL_TIMEOUT_MS, FAILSAFE_BITRATE, FAILSAFE_TX_PWR, RECONNECT_MAX
+    global POLICY, METRICS_PORT
 
     # Initialize the moving average lists.
-    rssi_history = []
-    rec_lost_samples = []
+    reset_policy_state()
 
     parser = argparse.ArgumentParser(
         description="JSON Stream Client with periodic HEARTBEAT messages and REC_LOST detection")
@@ -355,9 +714,29 @@ def main():
                         help="Destination IP for UDP transmissions (default: 10.5.0.10)")
     parser.add_argument("--udp_port", type=int, default=5557,
                         help="Destination port for UDP transmissions (default: 5557)")
+    parser.add_argument("--policy", choices=["rssi", "predictive"], default=POLICY,
+                        help="Rate control policy: rssi (moving average) or predictive (fec/lost/RSSI trends)")
+    parser.add_argument("--metrics_port", type=int, default=METRICS_PORT,
+                        help="Serve metrics on http://127.0.0.1:PORT/metrics (and /metrics.json); 0 disables (default: 0)")
+    parser.add_argument("--stall_timeout", type=int, default=STALL_TIMEOUT_MS,
+                        help=f"Milliseconds without video rx stats before failsafe (default: {STALL_TIMEOUT_MS})")
+    parser.add_argument("--failsafe_bitrate", type=int, default=FAILSAFE_BITRATE,
+                        help=f"Bitrate pushed on stall/disconnect (default: {FAILSAFE_BITRATE})")
+    parser.add_argument("--failsafe_tx_pwr", type=int, default=FAILSAFE_TX_PWR,
+                        help=f"TX power pushed on stall/disconnect (default: {FAILSAFE_TX_PWR})")
+    parser.add_argument("--reconnect_max", type=float, default=RECONNECT_MAX,
+                        help=f"Reconnect backoff cap in seconds (default: {RECONNECT_MAX})")
     args = parser.parse_args()
+    if args.stall_timeout <= 0:
+        parser.error("--stall_timeout must be greater than 0")
 
     VERBOSITY = args.verbose
+    POLICY = args.policy
+    METRICS_PORT = args.metrics_port
+    STALL_TIMEOUT_MS = args.stall_timeout
+    FAILSAFE_BITRATE = args.failsafe_bitrate
+    FAILSAFE_TX_PWR = args.failsafe_tx_pwr
+    RECONNECT_MAX = args.reconnect_max
     HEARTBEAT_INTERVAL = args.heartbeat
     UDP_MODE = args.udp
 
@@ -367,9 +746,9 @@ def main():
         try:
             udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            log(1, f"[MAIN] Running in UDP mode: transmitting to {udp_ip}:{udp_port}.")
+            log(1, "[MAIN] Running in UDP mode: transmitting to %s:%s.", udp_ip, udp_port)
         except Exception as e:
-            log(1, f"[MAIN] Failed to create UDP socket: {e}")
+            log(1, "[MAIN] Failed to create UDP socket: %s", e)
             shutdown_event.set()
 
     # Start the ack listener thread only if not in UDP mode.
@@ -379,6 +758,11 @@ def main():
     else:
         log(1, "[MAIN] UDP mode active: ignoring STDIN (ACK listener not started).")
 
+    # Start the metrics endpoint if requested.
+    if METRICS_PORT:
+        metrics_thread = threading.Thread(target=metrics_server, args=(METRICS_PORT,), daemon=True)
+        metrics_thread.start()
+
     # Start the JSON socket listener thread.
     socket_thread = threading.Thread(target=socket_listener, daemon=True)
     socket_thread.start()
@@ -395,7 +779,8 @@ def main():
         log(1, "[MAIN] Terminated by user (KeyboardInterrupt).")
         shutdown_event.set()
 
-    log(1, "[MAIN] Shutdown event set. Exiting gracefully.")
+    if VERBOSITY >= 1:
+        log(1, "[MAIN] Shutdown event set. Metrics: %s. Exiting gracefully.", get_metrics())
     sys.exit(0)
 
 if __name__ == '__main__':